@@ -1,65 +1,109 @@
 from dataiku.llm.agent_tools import BaseAgentTool
 import requests
-from googleapiclient.discovery import build
-import logging
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cachetools import TTLCache
+import json
+import threading
+
+CSE_URL = "https://customsearch.googleapis.com/customsearch/v1"
+# Only request the parts of each result that are returned by the tool
+CSE_FIELDS = "items(link,title,snippet,htmlSnippet,pagemap/cse_thumbnail)"
+REQUEST_TIMEOUT_SECONDS = 10
+RETRY_STRATEGY = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    respect_retry_after_header=True,
+    # Let raise_for_status report the last error instead of a RetryError
+    raise_on_status=False
+)
+
+# Web results go stale quickly, keep cached responses short-lived
+CACHE_TTL_SECONDS = 60
+CACHE_MAX_SIZE = 512
+
+DESCRIPTOR = {
+    "description": "Searches the web. Returns an array of results. For each result, returns url title, and snippet",
+    "inputSchema" : {
+        "$id": "https://dataiku.com/agents/tools/search/input",
+        "title": "Input for the search tool",
+        "type": "object",
+        "properties" : {
+            "q" : {
+                "type": "string",
+                "description": "The query string"
+            }
+        },
+        "required": ["q"]
+    }
+}
 
 class GoogleWebSearchTool(BaseAgentTool):
     def set_config(self, config, plugin_config):
         self.config = config
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(max_retries=RETRY_STRATEGY))
+        self._cache = TTLCache(maxsize=CACHE_MAX_SIZE, ttl=CACHE_TTL_SECONDS)
+        self._cache_lock = threading.Lock()
 
     def get_descriptor(self, tool):
-        return {
-            "description": "Searches the web. Returns an array of results. For each result, returns url title, and snippet",            
-            "inputSchema" : {
-                "$id": "https://dataiku.com/agents/tools/search/input",
-                "title": "Input for the search tool",
-                "type": "object",
-                "properties" : {
-                    "q" : {
-                        "type": "string",
-                        "description": "The query string"
-                    }
-                },
-                "required": ["q"]            
-            }
-        }
+        return DESCRIPTOR
 
     def invoke(self, input, trace):
         args = input["input"]
         q = args["q"]
-        api_key = self.config["google_search_api_connection"]["apiKey"]
 
-        # This logger outputs the key in DEBUG mode ...
-        logging.getLogger("googleapiclient.discovery").setLevel("INFO")
+        use_cache = self.config.get("cache_results", True)
+        if use_cache:
+            cache_key = json.dumps(args, sort_keys=True)
+            with self._cache_lock:
+                cached = self._cache.get(cache_key)
+            if cached is not None:
+                return cached
 
-        service = build("customsearch", "v1", developerKey=api_key)
-        res = service.cse().list(q=q, cx=self.config["cx"]).execute()
+        api_key = self.config["google_search_api_connection"]["apiKey"]
+
+        # Pass the key as a header so that it does not end up in logged URLs or error messages
+        r = self._session.get(CSE_URL,
+                              params={"cx": self.config["cx"], "q": q, "fields": CSE_FIELDS},
+                              headers={"X-goog-api-key": api_key},
+                              timeout=REQUEST_TIMEOUT_SECONDS)
+        r.raise_for_status()
+        res = r.json()
         
         source_items = []
         results = []
         for item in res["items"]:
+            url = item["link"]
+            title = item["title"]
             source_item = {
                 "type": "SIMPLE_DOCUMENT",
-                "url": item["link"],
-                "title": item["title"],
+                "url": url,
+                "title": title,
                 "htmlSnippet": item["htmlSnippet"]
             }
-            if "pagemap" in item and "cse_thumbnail" in item["pagemap"] and "src" in item["pagemap"]["cse_thumbnail"]:
-                source_item["thumbnailImageURL"] = item["pagemap"]["cse_thumbnail"]["src"]
-                source_item["thumbnailImageW"] = item["pagemap"]["cse_thumbnail"].get("width")
-                source_item["thumbnailImageH"] = item["pagemap"]["cse_thumbnail"].get("height")
+            thumbnail = item.get("pagemap", {}).get("cse_thumbnail", {})
+            if "src" in thumbnail:
+                source_item["thumbnailImageURL"] = thumbnail["src"]
+                source_item["thumbnailImageW"] = thumbnail.get("width")
+                source_item["thumbnailImageH"] = thumbnail.get("height")
             
             results.append({
-                "url": item["link"],
-                "title": item["title"],
+                "url": url,
+                "title": title,
                 "snippet": item["snippet"]
             })
             source_items.append(source_item)
             
-        return { 
+        response = { 
             "output" : results,
             "sources":  [{
                 "toolCallDescription": "Performed Web Search for: %s" %q,
                 "items" : source_items
             }]
-        }
\ No newline at end of file
+        }
+        if use_cache:
+            with self._cache_lock:
+                self._cache[cache_key] = response
+        return response